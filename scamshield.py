@@ -2,11 +2,23 @@ from __future__ import annotations
 
 import re
 import os
+import sys
 import json
+import hashlib
+import threading
 from pathlib import Path
+from bisect import bisect_right
+from collections import OrderedDict
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import compress, islice, product
 from typing import Any, Dict, List, Tuple, Optional
-from urllib.parse import urlparse
+from urllib.parse import urlsplit
+
+try:
+    import ahocorasick  # pyahocorasick（選用）：純文字關鍵字一次掃完
+except ImportError:
+    ahocorasick = None
 
 
 # =========================
@@ -22,9 +34,16 @@ URL_RE = re.compile(
     )"""
 )
 
+# 手機的 (?:\+?886)?0? 拆成各自一條分支（順序同貪婪比對），每條都從固定字開頭，re 才能快速略過
 PHONE_RE = re.compile(r"""(?x)
     (?:
-      (?:\+?886[-\s]?)?0?9\d{2}[-\s]?\d{3}[-\s]?\d{3}   # 台灣手機
+      \+886[-\s]?0?9\d{2}[-\s]?\d{3}[-\s]?\d{3}        # 台灣手機 +886
+      |
+      886[-\s]?0?9\d{2}[-\s]?\d{3}[-\s]?\d{3}          # 台灣手機 886
+      |
+      09\d{2}[-\s]?\d{3}[-\s]?\d{3}                    # 台灣手機
+      |
+      9\d{2}[-\s]?\d{3}[-\s]?\d{3}
       |
       0\d{1,2}[-\s]?\d{6,8}                              # 市話
     )
@@ -33,18 +52,28 @@ PHONE_RE = re.compile(r"""(?x)
 EMAIL_RE = re.compile(r"\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[A-Za-z]{2,}\b")
 
 # 很粗略：銀行帳號/卡號通常是長數字，避免誤抓一般數字
-LONG_NUMBER_RE = re.compile(r"\b\d{10,19}\b")
+# 等同 \b\d{10,19}\b；開頭改成 \d 才能快速略過非數字
+LONG_NUMBER_RE = re.compile(r"\d(?<!\w\d)\d{9,18}(?!\w)")
+
+# 粗切句子：中英標點
+SENTENCE_SEPARATORS = "。！？!?;\n\r"
+# 直接比對「去掉頭尾空白後」的句子：非空白開頭、非空白結尾（\s 跟 str.strip() 認的空白一樣）
+SENTENCE_RE = re.compile(f"[^{SENTENCE_SEPARATORS}\\s](?:[^{SENTENCE_SEPARATORS}]*[^{SENTENCE_SEPARATORS}\\s])?")
 
-SHORTENER_DOMAINS = {
+# analyze_url_risk 有快取，這兩個表執行中不能改，用 frozenset 固定下來
+SHORTENER_DOMAINS = frozenset({
     "tinyurl.com", "bit.ly", "reurl.cc", "t.co", "is.gd", "cutt.ly", "goo.gl", "rb.gy"
-}
+})
 
-SUSPICIOUS_TLDS = {
+SUSPICIOUS_TLDS = frozenset({
     "top", "xyz", "site", "click", "live", "icu", "cfd", "shop", "work", "info"
-}
+})
 
 PUNYCODE_PREFIX = "xn--"
 
+# 同一個網址常在不同訊息重複出現（詐騙簡訊大量發送），評分結果直接快取
+URL_RISK_CACHE_SIZE = 8192
+
 
 def _norm_url(u: str) -> str:
     u = u.strip()
@@ -54,45 +83,46 @@ def _norm_url(u: str) -> str:
 
 
 def extract_urls(text: str) -> List[str]:
-    urls = []
-    for m in URL_RE.finditer(text or ""):
-        urls.append(m.group(1).rstrip(".,;:!?)]}"))
+    text = text or ""
+    # 沒有 :// 也沒有 www. 就不可能有網址，省掉整段 regex 掃描
+    if "://" not in text and "www." not in text.lower():
+        return []
     # 去重保序
-    seen = set()
-    out = []
-    for u in urls:
-        if u not in seen:
-            seen.add(u)
-            out.append(u)
-    return out
+    out: Dict[str, None] = {}
+    for m in URL_RE.finditer(text):
+        out[m.group(1).rstrip(".,;:!?)]}")] = None
+    return list(out)
 
 
 def extract_entities(text: str) -> Dict[str, List[str]]:
-    phones = list(dict.fromkeys(PHONE_RE.findall(text or "")))
-    emails = list(dict.fromkeys(EMAIL_RE.findall(text or "")))
-    long_nums = list(dict.fromkeys(LONG_NUMBER_RE.findall(text or "")))
-    urls = extract_urls(text or "")
+    text = text or ""
     return {
-        "phones": phones,
-        "emails": emails,
-        "long_numbers": long_nums,
-        "urls": urls,
+        "phones": list(dict.fromkeys(PHONE_RE.findall(text))),
+        "emails": list(dict.fromkeys(EMAIL_RE.findall(text))) if "@" in text else [],
+        "long_numbers": list(dict.fromkeys(LONG_NUMBER_RE.findall(text))),
+        "urls": extract_urls(text),
     }
 
 
 def domain_of(url: str) -> str:
     try:
-        pu = urlparse(_norm_url(url))
+        pu = urlsplit(_norm_url(url))  # 只要 hostname，不用 urlparse 多拆 params
         host = (pu.hostname or "").lower()
         return host
     except Exception:
         return ""
 
 
+def _is_ip_parts(parts: List[str]) -> bool:
+    # 等同 (?:\d{1,3}\.){3}\d{1,3} 的 fullmatch（\d 就是 str.isdecimal）
+    return len(parts) == 4 and all(0 < len(p) <= 3 and p.isdecimal() for p in parts)
+
+
 def is_ip_host(host: str) -> bool:
-    return bool(re.fullmatch(r"(?:\d{1,3}\.){3}\d{1,3}", host or ""))
+    return _is_ip_parts((host or "").split("."))
 
 
+@lru_cache(maxsize=URL_RISK_CACHE_SIZE)
 def analyze_url_risk(url: str) -> Tuple[int, str]:
     """
     return (score, reason)
@@ -108,16 +138,17 @@ def analyze_url_risk(url: str) -> Tuple[int, str]:
         score += 25
         reasons.append("短網址（常用於釣魚跳轉）")
 
-    if host.startswith(PUNYCODE_PREFIX) or PUNYCODE_PREFIX in host:
+    if PUNYCODE_PREFIX in host:
         score += 20
         reasons.append("疑似混淆網域（punycode）")
 
-    if is_ip_host(host):
+    parts = host.split(".")  # 下面 IP / tld / 子網域都用同一份
+
+    if _is_ip_parts(parts):
         score += 30
         reasons.append("IP 直連網址（很可疑）")
 
     # tld
-    parts = host.split(".")
     if len(parts) >= 2:
         tld = parts[-1]
         if tld in SUSPICIOUS_TLDS:
@@ -156,64 +187,134 @@ class Rule:
     stage_hint: str  # pipeline stage hint
     note: str = ""
 
+
 # =========================
-# Rules hot loading
+# Regex helpers
 # =========================
 
-RULES_PATH = Path(__file__).parent / "rules.json"
+_REGEX_META = set(".^$*+?{}[]()|")
 
-_rules_cache = {
-    "mtime": 0,
-    "rules": []
-}
 
-def load_rules_from_json() -> list:
+def _split_alternatives(src: str) -> List[str]:
     """
-    從 rules.json 讀規則，支援熱更新（檔案變了才重讀）
+    依最外層的 | 切開 regex（跳過跳脫字元、[...]、(...) 裡面的 |）
     """
-    global _rules_cache
+    parts = []
+    buf = []
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            buf.append(src[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            parts.append("".join(buf))
+            buf = []
+            i += 1
+            continue
+        buf.append(c)
+        i += 1
+    parts.append("".join(buf))
+    return parts
 
-    if not RULES_PATH.exists():
-        print("[WARN] rules.json not found, fallback to empty rules")
-        return []
 
-    mtime = RULES_PATH.stat().st_mtime
-    if mtime == _rules_cache["mtime"]:
-        return _rules_cache["rules"]
+# re.IGNORECASE 下每個英文字母實際會比對到的字（含 Unicode 的特殊對應，例如 K 開爾文符號、ſ）
+_ASCII_CASE_VARIANTS: Dict[str, str] = {}
+for _c in "abcdefghijklmnopqrstuvwxyz":
+    _ASCII_CASE_VARIANTS[_c] = _ASCII_CASE_VARIANTS[_c.upper()] = (
+        _c + _c.upper() + {"i": "\u0130\u0131", "k": "\u212a", "s": "\u017f"}.get(_c, "")
+    )
 
-    try:
-        with open(RULES_PATH, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-
-        rules = []
-        for r in raw.get("rules", []):
-            rules.append(
-                Rule(
-                    name=r["name"],
-                    score=int(r["score"]),
-                    patterns=[_p(p) for p in r.get("patterns", [])],
-                    scam_types=r.get("scam_types", []),
-                    stage_hint=r.get("stage_hint", ""),
-                    note=r.get("note", "")
-                )
-            )
+# 這些跳脫不受 IGNORECASE 影響；其他 \x41、\N{...}、\1 之類交給 re.IGNORECASE 處理
+_CASELESS_ESCAPES = set("sdwSDWbBAZ")
+_GLOBAL_FLAGS_RE = re.compile(r"\(\?[aiLmsux]")
 
-        _rules_cache = {
-            "mtime": mtime,
-            "rules": rules
-        }
 
-        print(f"[OK] Loaded {len(rules)} rules from rules.json")
-        return rules
+def _is_cased(c: str) -> bool:
+    return c.lower() != c or c.upper() != c
 
-    except Exception as e:
-        print("[ERROR] Failed to load rules.json:", e)
-        return _rules_cache["rules"]
 
+def _fold_ascii(alt: str) -> Optional[List[str]]:
+    """
+    把分支裡的英文字母改寫成 [Oo][Tt][Pp] 這種字元集合，不用 IGNORECASE 也能比對到一樣的字
+    開頭是字母就拆成大小寫各一條分支（O[Tt][Pp]|o[Tt][Pp]），re 才能用開頭字做快速略過
+    沒把握的語法（非英文的大小寫字、字元範圍、\x41、(?i) 之類）回 None
+    """
+    out: List[str] = []
+    i = 0
+    while i < len(alt):
+        c = alt[i]
+        if c == "\\":
+            nxt = alt[i + 1:i + 2]
+            if nxt.isalnum() and nxt not in _CASELESS_ESCAPES:
+                return None
+            out.append(alt[i:i + 2])
+            i += 2
+            continue
+        if c == "[":
+            j = i + 1
+            if alt[j:j + 1] == "^":
+                j += 1
+            if alt[j:j + 1] == "]":
+                j += 1
+            while j < len(alt) and alt[j] != "]":
+                j += 2 if alt[j] == "\\" else 1
+            cls = alt[i:j + 1]
+            if "-" in cls or "\\" in cls or any(_is_cased(x) for x in cls):
+                return None
+            out.append(cls)
+            i = j + 1
+            continue
+        if c == "(" and alt[i + 1:i + 2] == "?" and alt[i + 2:i + 3] != ":":
+            return None
+        if c in _ASCII_CASE_VARIANTS:
+            out.append("[" + _ASCII_CASE_VARIANTS[c] + "]")
+        elif _is_cased(c):
+            return None
+        else:
+            out.append(c)
+        i += 1
+
+    # 開頭字母後面接量詞、或分支裡有群組（複製會改到群組編號）就不拆
+    first = alt[:1]
+    if first in _ASCII_CASE_VARIANTS and alt[1:2] not in ("?", "*", "+", "{") and "(" not in alt:
+        rest = "".join(out[1:])
+        return [v + rest for v in _ASCII_CASE_VARIANTS[first]]
+    return ["".join(out)]
 
 
 def _p(s: str) -> re.Pattern:
-    return re.compile(s, re.IGNORECASE)
+    """
+    規則 regex 一律不分大小寫；但 re.IGNORECASE 會讓 re 沒辦法用開頭字快速略過，
+    純中文為主的規則會慢好幾倍，所以把英文字母展開成字元集合，整條照大小寫敏感編譯
+    比對結果（含命中位置）跟 re.compile(s, re.IGNORECASE) 一樣；沒把握的就照舊
+    """
+    if _GLOBAL_FLAGS_RE.match(s):
+        return re.compile(s, re.IGNORECASE)
+
+    out: List[str] = []
+    try:
+        for alt in _split_alternatives(s):
+            re.compile(alt)  # 切錯（例如括號沒配對）就整條照舊
+            folded = _fold_ascii(alt)
+            if folded is None:
+                return re.compile(s, re.IGNORECASE)
+            out.extend(folded)
+        return re.compile("|".join(out))
+    except re.error:
+        return re.compile(s, re.IGNORECASE)
 
 
 DEFAULT_RULES: List[Rule] = [
@@ -287,7 +388,7 @@ DEFAULT_RULES: List[Rule] = [
     Rule(
         name="出金卡關/解凍費/保證金/稅金",
         score=40,
-        patterns=[_p(r"出金|提領|提款|解凍|保證金|押金|手續費|稅金|所得稅|保證金|驗證金|風控|流水|補款|補繳")],
+        patterns=[_p(r"出金|提領|提款|解凍|保證金|押金|手續費|稅金|所得稅|驗證金|風控|流水|補款|補繳")],
         scam_types=["投資詐騙","平台出金詐騙"],
         stage_hint="要求匯款",
     ),
@@ -449,6 +550,19 @@ _RULES_CACHE: Optional[List[Rule]] = None
 _RULES_MTIME: Optional[float] = None
 
 
+def _intern(x: Any) -> Any:
+    # 規則名稱 / scam_type / stage 每次分析都拿來當 dict key
+    # 非 ASCII 的字面字串 CPython 不會自動 intern：兩邊（規則 + STAGE_* 常數）都要 sys.intern 才會是同一個物件
+    return sys.intern(x) if type(x) is str else x
+
+
+for _rule in DEFAULT_RULES:
+    _rule.name = _intern(_rule.name)
+    _rule.scam_types = [_intern(t) for t in _rule.scam_types]
+    _rule.stage_hint = _intern(_rule.stage_hint)
+del _rule
+
+
 def _load_rules_from_json(path: Path) -> List[Rule]:
     raw = json.loads(path.read_text(encoding="utf-8"))
     items = raw.get("rules", raw)  # 允許 {"rules":[...]} 或直接 [...]
@@ -459,11 +573,11 @@ def _load_rules_from_json(path: Path) -> List[Rule]:
 
         rules.append(
             Rule(
-                name=it.get("name", "未命名規則"),
+                name=_intern(it.get("name", "未命名規則")),
                 score=int(it.get("score", 10)),
                 patterns=pats,
-                scam_types=it.get("scam_types", []) or [],
-                stage_hint=it.get("stage_hint", "資訊投放"),
+                scam_types=[_intern(t) for t in (it.get("scam_types", []) or [])],
+                stage_hint=_intern(it.get("stage_hint", "資訊投放")),
                 note=it.get("note", "") or "",
             )
         )
@@ -491,39 +605,245 @@ def get_rules(force_reload: bool = False) -> List[Rule]:
 
 
 
-def _split_sentences(text: str) -> List[str]:
-    # 粗切：中英標點
-    parts = re.split(r"[。！？!?;\n\r]+", text or "")
-    parts = [p.strip() for p in parts if p.strip()]
-    return parts
+# =========================
+# Keyword automaton（Aho-Corasick）
+# =========================
+
+
+# 一個分支最多展開成幾個關鍵字（OTP 這種短字會展開，TeamViewer 這種長字就留給 regex）
+_MAX_LITERAL_VARIANTS = 256
 
 
-def _find_evidence(sentences: List[str], rule: Rule) -> List[str]:
-    ev = []
-    for s in sentences:
+def _as_literals(alt: str, flags: int) -> Optional[List[str]]:
+    """
+    分支是純文字就回傳它能比對到的所有字串，否則 None
+    單純的字元集合（_p 展開英文字母產生的 [tT]）也算，會展開成 oTP、otP... 這些變體
+    IGNORECASE 下只收沒有大小寫的字（中文、數字、符號），這樣直接比對才會跟 regex 一致
+    這些關鍵字一定落在單一句子裡，命中位置可以直接對回句子
+    """
+    choices: List[str] = []  # 每個位置可以是哪些字
+    i = 0
+    while i < len(alt):
+        c = alt[i]
+        if c == "\\":
+            nxt = alt[i + 1:i + 2]
+            if not nxt or nxt.isalnum():
+                return None  # \s、\d、\b 之類
+            chars = nxt
+            i += 2
+        elif c == "[":
+            j = alt.find("]", i + 2)  # 緊接在 [ 後面的 ] 是字面
+            if j < 0:
+                return None
+            chars = alt[i + 1:j]
+            if chars[:1] == "^" or any(x in chars for x in "-\\["):
+                return None  # 排除、範圍、跳脫：交給 regex
+            i = j + 1
+        elif c in _REGEX_META:
+            return None
+        else:
+            chars = c
+            i += 1
+        if flags & re.IGNORECASE and any(_is_cased(x) for x in chars):
+            return None
+        choices.append("".join(dict.fromkeys(chars)))
+
+    total = 1
+    for chars in choices:
+        total *= len(chars)
+    if not choices or total > _MAX_LITERAL_VARIANTS:
+        return None
+
+    lits = ["".join(p) for p in product(*choices)]
+    # 含斷句符號或頭尾空白的關鍵字可能跨句，交給 regex 逐句判斷
+    for lit in lits:
+        if lit != lit.strip() or any(c in SENTENCE_SEPARATORS for c in lit):
+            return None
+    return lits
+
+
+@dataclass(eq=False)  # 用 identity 當 hash，才能拿來當 analyze 快取的 key
+class RuleMatcher:
+    rules: List[Rule]
+    automaton: Any  # ahocorasick.Automaton：關鍵字 -> 命中的 rule index；None = 沒裝套件或沒有可用關鍵字
+    residual: List[List[re.Pattern]]  # 每條規則扣掉關鍵字後，還要跑 regex 的部分
+    combo_flags: List[int]  # 每條規則的 COMBO_* bit（連動加成 / 收尾判斷用，見 _combo_flags）
+    residual_any: Optional[re.Pattern]  # 所有殘餘 regex 的聯集：沒中就不用逐條跑；None = 合不起來
+
+
+_UNSAFE_UNION_RE = re.compile(r"\\\d|\(\?P=|\(\?\(")
+
+
+def _union_pattern(pats: List[re.Pattern]) -> Optional[re.Pattern]:
+    """
+    把多條 regex 用 | 接成一條，只拿來判斷「有沒有任何一條會中」
+    整條都從固定字開頭，re 可以一次快速略過；單獨掃 N 次反而慢
+    旗標不同、有 backreference / 條件群組（群組編號會變）、開頭有全域旗標的就不合
+    """
+    if not pats:
+        return None
+    for pat in pats:
+        if pat.flags != re.UNICODE or _UNSAFE_UNION_RE.search(pat.pattern) or _GLOBAL_FLAGS_RE.match(pat.pattern):
+            return None
+    try:
+        return re.compile("|".join(pat.pattern for pat in pats))
+    except re.error:
+        return None  # 例如兩條規則用了同名群組
+
+
+def _new_matcher(rules: List[Rule], automaton: Any, residual: List[List[re.Pattern]]) -> RuleMatcher:
+    return RuleMatcher(
+        rules=rules,
+        automaton=automaton,
+        residual=residual,
+        combo_flags=[_combo_flags(r) for r in rules],
+        residual_any=_union_pattern([pat for pats in residual for pat in pats]),
+    )
+
+
+def _build_matcher(rules: List[Rule]) -> RuleMatcher:
+    if ahocorasick is None:
+        return _new_matcher(rules, None, [list(r.patterns) for r in rules])
+
+    keywords: Dict[str, set] = {}
+    residual: List[List[re.Pattern]] = []
+    for i, rule in enumerate(rules):
+        pats = []
         for pat in rule.patterns:
-            if pat.search(s):
-                ev.append(s)
-                break
-    # 限制證據句數量
-    return ev[:4]
+            if pat.flags & re.VERBOSE:
+                pats.append(pat)  # VERBOSE 的空白/註解不是字面字，不拆成關鍵字，整條照舊跑 regex
+                continue
+            alts = _split_alternatives(pat.pattern)
+            lits = [_as_literals(a, pat.flags) for a in alts]
+            rest = [a for a, lit in zip(alts, lits) if lit is None]
+            try:
+                rest_pat = re.compile("|".join(rest), pat.flags) if rest else None
+                for a in rest:
+                    re.compile(a, pat.flags)  # 切錯（例如括號沒配對）就整條退回原本的 regex
+            except re.error:
+                pats.append(pat)
+                continue
+            for variants in lits:
+                for lit in variants or ():
+                    keywords.setdefault(lit, set()).add(i)
+            if rest_pat is not None:
+                pats.append(rest_pat)
+        residual.append(pats)
+
+    if not keywords:
+        return _new_matcher(rules, None, [list(r.patterns) for r in rules])
+
+    automaton = ahocorasick.Automaton()
+    for kw, ids in keywords.items():
+        automaton.add_word(kw, tuple(sorted(ids)))
+    automaton.make_automaton()
+    return _new_matcher(rules, automaton, residual)
+
+
+_MATCHER: Optional[RuleMatcher] = None
+
+
+def get_matcher(force_reload: bool = False) -> RuleMatcher:
+    """
+    跟著 get_rules() 的熱更新走：規則換了才重建 automaton
+    """
+    global _MATCHER
+
+    rules = get_rules(force_reload)
+    if _MATCHER is None or _MATCHER.rules is not rules:
+        _MATCHER = _build_matcher(rules)
+        _analyze_cached.cache_clear()  # 舊規則的結果用不到了
+        with _LONG_CACHE_LOCK:
+            _LONG_CACHE.clear()
+    return _MATCHER
+
+
+def _scan_rules(
+    matcher: RuleMatcher,
+    text: str,
+    kw_ends: Optional[Dict[int, List[int]]] = None,
+) -> set:
+    """
+    回傳 text 命中的 rule index
+    結果等同逐條 pat.search(text)
+    kw_ends：有給就順便記下關鍵字命中的結尾位置（rule index -> [offset]）
+    """
+    found: set = set()
+    if matcher.automaton is not None:
+        for end, ids in matcher.automaton.iter(text):
+            found.update(ids)
+            if kw_ends is not None:
+                for i in ids:
+                    kw_ends.setdefault(i, []).append(end)
+
+    # 聯集沒中 = 沒有任何殘餘 regex 會中（一般聊天、短訊息最常見），整段略過
+    if matcher.residual_any is None or matcher.residual_any.search(text):
+        residual = matcher.residual
+        for i in range(len(residual)):
+            if i in found:
+                continue
+            for pat in residual[i]:
+                if pat.search(text):
+                    found.add(i)
+                    break
+
+    return found
+
+
+def _split_sentences(text: str) -> Tuple[List[str], List[int]]:
+    """
+    回傳 (句子, 每句在 text 裡的起始位置)
+    """
+    ms = list(SENTENCE_RE.finditer(text or ""))
+    return [m.group() for m in ms], [m.start() for m in ms]
+
+
+def _find_evidence(
+    matcher: RuleMatcher,
+    sentences: List[str],
+    offsets: List[int],
+    hit: set,
+    kw_ends: Dict[int, List[int]],
+) -> Dict[int, List[str]]:
+    """
+    回傳 rule index -> 證據句
+    - 關鍵字：全文掃描時的命中位置直接對回句子，不用再掃
+    - 其餘 regex：只對已命中的規則逐句補查，每個 regex 找到 4 句就停
+    """
+    ev: Dict[int, set] = {i: set() for i in hit}
+    for i, ends in kw_ends.items():
+        if i in ev:
+            ev[i].update(bisect_right(offsets, e) - 1 for e in ends)
+
+    n = len(sentences)
+    out: Dict[int, List[str]] = {}
+    for i, idx in ev.items():
+        # 每個 regex 只要最前面 4 句命中的（map/compress/islice 都在 C 裡跑，不用逐句進 Python 迴圈）
+        # 聯集後取最前面 4 句，跟逐句檢查湊滿 4 句的結果一樣
+        for pat in matcher.residual[i]:
+            idx.update(islice(compress(range(n), map(pat.search, sentences)), 4))
+        out[i] = [sentences[j] for j in sorted(idx)[:4]]
+    return out
 
 
-STAGE_ORDER = [
+STAGE_ORDER = [sys.intern(st) for st in (
     "資訊投放",
     "建立信任",
     "轉移平台",
     "要求資料/驗證",
     "要求匯款",
     "威脅施壓",
-]
+)]
+# 分析時查 stage_scores 用這幾個（intern 過，跟規則的 stage_hint 是同一個物件）
+STAGE_INFO, STAGE_TRUST, STAGE_MOVE, STAGE_VERIFY, STAGE_PAY, STAGE_THREAT = STAGE_ORDER
+_STAGE_RANK = {st: i for i, st in enumerate(STAGE_ORDER)}
 
 
 def _pick_stage(stage_scores: Dict[str, int]) -> str:
     if not stage_scores:
-        return "資訊投放"
+        return STAGE_INFO
     # 分數最高者；同分就取更後面（越後面通常越危險）
-    best = max(stage_scores.items(), key=lambda kv: (kv[1], STAGE_ORDER.index(kv[0]) if kv[0] in STAGE_ORDER else 0))
+    best = max(stage_scores.items(), key=lambda kv: (kv[1], _STAGE_RANK.get(kv[0], 0)))
     return best[0]
 
 
@@ -537,39 +857,182 @@ def _risk_level(score: int) -> str:
     return "low"
 
 
+# 分數收尾後一定是 0~100 的整數：直接查表，不用每次跑 if 階梯
+_RISK_LEVEL_BY_SCORE = tuple(_risk_level(s) for s in range(101))
+
+
 def _merge_unique(items: List[str]) -> List[str]:
-    seen = set()
-    out = []
-    for x in items:
-        if x not in seen:
-            seen.add(x)
-            out.append(x)
+    return list(dict.fromkeys(items))  # 去重保序
+
+
+# 索取個資/驗證碼類：命中就額外加權
+COMBO_PII_TYPES = frozenset(("索取個資/驗證碼", "索取個資/金融資料"))
+
+# 連動加成 / 收尾要看的 scam_type：建 matcher 時先換成 bit，分析時只做整數 OR
+COMBO_PHISH = 1   # 釣魚連結
+COMBO_PII = 2     # 索取個資/驗證碼類
+COMBO_BORROW = 4  # 冒名熟人/借錢（回覆範本）
+
+
+def _combo_flags(rule: Rule) -> int:
+    flags = 0
+    if "釣魚連結" in rule.scam_types:
+        flags |= COMBO_PHISH
+    if not COMBO_PII_TYPES.isdisjoint(rule.scam_types):
+        flags |= COMBO_PII
+    if "冒名熟人/借錢" in rule.scam_types:
+        flags |= COMBO_BORROW
+    return flags
+
+
+def _combo_bonus(stage_scores: Dict[str, int], combo_mask: int) -> int:
+    """
+    連動加成：直接用規則迴圈算好的 stage_scores / 命中規則的 COMBO_* bit，不再重掃文字
+    """
+    combo = 0
+
+    s_threat = stage_scores.get(STAGE_THREAT, 0)
+    s_verify = stage_scores.get(STAGE_VERIFY, 0)
+    s_pay    = stage_scores.get(STAGE_PAY, 0)
+
+    # 威脅 + 要資料 / 威脅 + 要匯款：典型假客服/假公家機關
+    if s_threat > 0 and s_verify > 0:
+        combo += 12
+    if s_threat > 0 and s_pay > 0:
+        combo += 18
+
+    # 釣魚連結 + 要資料：高機率釣魚
+    if (combo_mask & COMBO_PHISH) and (s_verify > 0):
+        combo += 12
+
+    # 有索取個資/驗證碼類：額外加權（你之前說要加權，這邊才是真的做）
+    if combo_mask & COMBO_PII:
+        combo += 10
+
+    return combo
+
+
+# 使用者自己懷疑是詐騙（沒命中規則時的保底判斷用）
+SELF_DOUBT_RE = _p(r"是不是.*詐騙|被詐騙|被騙|詐騙嗎|真的假的|這是真的嗎|可靠嗎")
+
+
+# 建議行動 / 回覆範本：固定文字先建好，每次只複製成新的 list
+BASE_ACTIONS = (
+    "先冷靜：不要急著回覆，不要照做對方指示。",
+    "用官方管道自查：自己打開官方 App/官網，不要用對方給的連結。",
+    "保留證據：截圖、保存聊天紀錄、帳號、連結、轉帳資訊。",
+)
+HIGH_RISK_LEVELS = frozenset(("high", "critical"))
+HIGH_RISK_ACTIONS = (
+    "不要提供：驗證碼/密碼/卡號/身分證等任何敏感資訊。",
+    "若已匯款或提供資料：立刻改密碼、開啟兩步驗證，並通知銀行/平台。",
+    "可撥 165 反詐騙諮詢（台灣）或向警方報案。",
+)
+BASE_REPLY_TEMPLATES = (
+    "我會到官方管道自行查證，不會點不明連結或在這裡提供任何資料。",
+    "我不會提供驗證碼/密碼/卡號，也不會依照指示轉帳或購買點數。",
+    "若你是官方單位，請提供正式公文/案件編號與可回撥的官方電話，我會自行致電確認。",
+)
+IMPERSONATION_REPLY_TEMPLATE = "你先用電話/視訊跟我確認身分，我確認是本人再說。現在我不會轉帳。"
+
+# 只有這幾種組合：先拼好，分析時直接挑一個 tuple（交出去時 _copy_result 才轉成 list）
+ACTIONS_HIGH_RISK = BASE_ACTIONS + HIGH_RISK_ACTIONS
+IMPERSONATION_REPLY_TEMPLATES = (IMPERSONATION_REPLY_TEMPLATE,) + BASE_REPLY_TEMPLATES
+
+
+# 同一段文字重複送（重試、同一張截圖貼兩次、被大量轉傳的詐騙訊息）直接回快取
+# 短文字用原文當 key；長文字改用 sha256，快取裡就不用留整段原文
+ANALYZE_CACHE_SIZE = int(os.getenv("ANALYZE_CACHE_SIZE", "4096"))
+ANALYZE_CACHE_MAX_TEXT = 4096
+ANALYZE_LONG_CACHE_SIZE = 256
+
+_LONG_CACHE: "OrderedDict[bytes, Tuple[RuleMatcher, Dict[str, Any]]]" = OrderedDict()
+_LONG_CACHE_LOCK = threading.Lock()
+
+
+def _copy_result(res: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    快取裡的結果交出去前複製一份（只複製會被改到的 list/dict，比 deepcopy 快很多）
+    recommended_actions / reply_templates 在快取裡是共用的 tuple，這裡才轉成 list
+    """
+    out = dict(res)
+    out["scam_types"] = list(res["scam_types"])
+    out["triggered_rules"] = [
+        dict(r, evidence_sentences=list(r["evidence_sentences"])) for r in res["triggered_rules"]
+    ]
+    out["recommended_actions"] = list(res["recommended_actions"])
+    out["reply_templates"] = list(res["reply_templates"])
+    out["suspicious_urls"] = [dict(u) for u in res["suspicious_urls"]]
+    out["entities"] = {k: list(v) for k, v in res["entities"].items()}
     return out
 
 
 def analyze_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    context 目前沒用到，所以快取只看 text 跟當下的規則
+    """
+    return _analyze_with(text, get_matcher())
+
+
+def analyze_texts(texts: List[str], context: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    批次分析（例如一次審一整批訊息）：規則只檢查/取一次，整批共用同一個 matcher
+    結果跟逐筆呼叫 analyze_text 一樣
+    """
+    matcher = get_matcher()
+    return [_analyze_with(t, matcher) for t in texts]
+
+
+def _analyze_with(text: str, matcher: RuleMatcher) -> Dict[str, Any]:
     text = (text or "").strip()
-    sentences = _split_sentences(text)
+    if len(text) > ANALYZE_CACHE_MAX_TEXT:
+        return _copy_result(_analyze_long_cached(text, matcher))
+    return _copy_result(_analyze_cached(text, matcher))
+
+
+@lru_cache(maxsize=ANALYZE_CACHE_SIZE)
+def _analyze_cached(text: str, matcher: RuleMatcher) -> Dict[str, Any]:
+    return _analyze(text, matcher)
+
+
+def _analyze_long_cached(text: str, matcher: RuleMatcher) -> Dict[str, Any]:
+    key = hashlib.sha256(text.encode("utf-8", "surrogatepass")).digest()
+    with _LONG_CACHE_LOCK:
+        cached = _LONG_CACHE.get(key)
+        if cached is not None and cached[0] is matcher:
+            _LONG_CACHE.move_to_end(key)
+            return cached[1]
+
+    res = _analyze(text, matcher)
+    with _LONG_CACHE_LOCK:
+        _LONG_CACHE[key] = (matcher, res)
+        _LONG_CACHE.move_to_end(key)
+        while len(_LONG_CACHE) > ANALYZE_LONG_CACHE_SIZE:
+            _LONG_CACHE.popitem(last=False)
+    return res
+
+
+def _analyze(text: str, matcher: RuleMatcher) -> Dict[str, Any]:
+    sentences, offsets = _split_sentences(text)
     entities = extract_entities(text)
     urls = entities.get("urls", [])
 
     triggered_rules = []
     scam_types: List[str] = []
     stage_scores: Dict[str, int] = {}
+    combo_mask = 0
 
     base_score = 0
 
-    for rule in get_rules():
+    kw_ends: Dict[int, List[int]] = {}
+    hit = _scan_rules(matcher, text, kw_ends=kw_ends)
+    evidence = _find_evidence(matcher, sentences, offsets, hit, kw_ends) if hit else {}
 
-        hit = False
-        for pat in rule.patterns:
-            if pat.search(text):
-                hit = True
-                break
-        if not hit:
+    for i, rule in enumerate(matcher.rules):
+        if i not in hit:
             continue
 
-        ev = _find_evidence(sentences, rule)
+        ev = evidence[i]
         triggered_rules.append({
             "name": rule.name,
             "score": rule.score,
@@ -578,6 +1041,7 @@ def analyze_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[st
         base_score += rule.score
         scam_types.extend(rule.scam_types)
         stage_scores[rule.stage_hint] = stage_scores.get(rule.stage_hint, 0) + rule.score
+        combo_mask |= matcher.combo_flags[i]
 
     scam_types = _merge_unique(scam_types)
 
@@ -599,26 +1063,7 @@ def analyze_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[st
     # =========================
     # 連動加成（Combo bonus）
     # =========================
-    combo = 0
-
-    s_threat = stage_scores.get("威脅施壓", 0)
-    s_verify = stage_scores.get("要求資料/驗證", 0)
-    s_pay    = stage_scores.get("要求匯款", 0)
-
-    # 威脅 + 要資料 / 威脅 + 要匯款：典型假客服/假公家機關
-    if s_threat > 0 and s_verify > 0:
-        combo += 12
-    if s_threat > 0 and s_pay > 0:
-        combo += 18
-
-    # 釣魚連結 + 要資料：高機率釣魚
-    if ("釣魚連結" in scam_types) and (s_verify > 0):
-        combo += 12
-
-    # 有索取個資/驗證碼類：額外加權（你之前說要加權，這邊才是真的做）
-    if any(t in scam_types for t in ["索取個資/驗證碼", "索取個資/金融資料"]):
-        combo += 10
-
+    combo = _combo_bonus(stage_scores, combo_mask)
 
     # =========================
     # 最終分數（唯一入口）
@@ -633,17 +1078,17 @@ def analyze_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[st
     # =========================
     if base_score == 0 and url_score_total == 0:
         # 使用者主動懷疑詐騙：沒命中規則也給基本警示
-        if _p(r"是不是.*詐騙|被詐騙|被騙|詐騙嗎|真的假的|這是真的嗎|可靠嗎").search(text):
+        if SELF_DOUBT_RE.search(text):
             score = max(score, 20)
-            stage_scores["資訊投放"] = stage_scores.get("資訊投放", 0) + 10
+            stage_scores[STAGE_INFO] = stage_scores.get(STAGE_INFO, 0) + 10
             if "疑似詐騙求證" not in scam_types:
                 scam_types.append("疑似詐騙求證")
 
     elif base_score == 0 and urls:
         # 只有網址命中（規則沒中）也要有基本風險
         score = max(score, min(30, max(url_score_total, 18)))
-        stage_scores["要求資料/驗證"] = stage_scores.get("要求資料/驗證", 0) + 10
-        if "釣魚連結" not in scam_types:
+        stage_scores[STAGE_VERIFY] = stage_scores.get(STAGE_VERIFY, 0) + 10
+        if not combo_mask & COMBO_PHISH:  # 命中的規則都沒有「釣魚連結」
             scam_types.append("釣魚連結")
 
 
@@ -651,7 +1096,7 @@ def analyze_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[st
     # 收尾（一定要有）
     # =========================
     score = max(0, min(score, 100))
-    level = _risk_level(score)
+    level = _RISK_LEVEL_BY_SCORE[score]
     stage = _pick_stage(stage_scores)
 
     # Explanation
@@ -671,26 +1116,10 @@ def analyze_text(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[st
     explanation = "\n".join(highlights)
 
     # Recommended actions
-    actions = [
-        "先冷靜：不要急著回覆，不要照做對方指示。",
-        "用官方管道自查：自己打開官方 App/官網，不要用對方給的連結。",
-        "保留證據：截圖、保存聊天紀錄、帳號、連結、轉帳資訊。",
-    ]
-    if level in ("high", "critical"):
-        actions.extend([
-            "不要提供：驗證碼/密碼/卡號/身分證等任何敏感資訊。",
-            "若已匯款或提供資料：立刻改密碼、開啟兩步驗證，並通知銀行/平台。",
-            "可撥 165 反詐騙諮詢（台灣）或向警方報案。",
-        ])
+    actions = ACTIONS_HIGH_RISK if level in HIGH_RISK_LEVELS else BASE_ACTIONS
 
     # Reply templates (可直接貼回對方)
-    templates = [
-        "我會到官方管道自行查證，不會點不明連結或在這裡提供任何資料。",
-        "我不會提供驗證碼/密碼/卡號，也不會依照指示轉帳或購買點數。",
-        "若你是官方單位，請提供正式公文/案件編號與可回撥的官方電話，我會自行致電確認。",
-    ]
-    if "冒名熟人/借錢" in scam_types:
-        templates.insert(0, "你先用電話/視訊跟我確認身分，我確認是本人再說。現在我不會轉帳。")
+    templates = IMPERSONATION_REPLY_TEMPLATES if combo_mask & COMBO_BORROW else BASE_REPLY_TEMPLATES
 
     return {
         "risk_score": score,
@@ -0,0 +1,87 @@
+"""
+關鍵字 automaton + 殘餘 regex 的掃描結果，要跟逐條 pat.search(text) 一模一樣
+特別是帶旗標的 pattern（(?x) / (?s) / (?i)）：rules.json 可以隨時改、會熱更新
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scamshield  # noqa: E402
+from scamshield import DEFAULT_RULES, Rule, _build_matcher, _p, _scan_rules  # noqa: E402
+
+
+def _rule(name, *patterns):
+    return Rule(name=name, score=10, patterns=[_p(p) for p in patterns], scam_types=["測試"], stage_hint="資訊投放")
+
+
+FLAGGED_RULES = [
+    _rule("verbose", r"(?x) 驗證 碼 | OTP"),
+    _rule("verbose-comment", r"(?x) 解 凍 \s* 金  # 註解不是字面字"),
+    _rule("dotall", r"(?s)先.匯款|安全帳戶"),
+    _rule("ignorecase", r"(?i)gift\s?card|禮物卡"),
+    _rule("mixed", r"(?is)line\s*id.我"),
+]
+
+TEXTS = [
+    "",
+    "hello OTP",
+    "hello otp",
+    "請給我驗證碼",
+    "請給我驗證 碼",
+    "解凍金",
+    "解凍 金",
+    "先\n匯款到安全帳戶",
+    "先匯款",
+    "買 GIFT CARD 給我",
+    "Gift card 跟禮物卡",
+    "LINE ID\n我",
+    "line id 我",
+    "請立即匯款 https://bit.ly/x 否則凍結",
+    "今天天氣不錯，晚餐吃什麼？",
+]
+
+
+def _expected(rules, text):
+    return {i for i, r in enumerate(rules) if any(p.search(text) for p in r.patterns)}
+
+
+class ScanRulesMatchesSearchTest(unittest.TestCase):
+    def _check(self, rules):
+        matcher = _build_matcher(rules)
+        for text in TEXTS:
+            with self.subTest(text=text):
+                self.assertEqual(_scan_rules(matcher, text), _expected(rules, text))
+
+    def test_default_rules_with_flagged_patterns(self):
+        self._check(list(DEFAULT_RULES) + FLAGGED_RULES)
+
+    def test_flagged_patterns_only(self):
+        self._check(FLAGGED_RULES)
+
+    def test_verbose_pattern_is_not_dropped(self):
+        rules = list(DEFAULT_RULES) + [_rule("verbose", r"(?x) 驗證 碼 | OTP")]
+        matcher = _build_matcher(rules)
+        self.assertIn(len(rules) - 1, _scan_rules(matcher, "hello OTP"))
+
+    @unittest.skipIf(scamshield.ahocorasick is None, "pyahocorasick 沒裝")
+    def test_verbose_pattern_stays_in_residual(self):
+        rules = list(DEFAULT_RULES) + [_rule("verbose", r"(?x) 驗證 碼 | OTP")]
+        matcher = _build_matcher(rules)
+        self.assertIsNotNone(matcher.automaton)
+        self.assertEqual([p.pattern for p in matcher.residual[-1]], [r"(?x) 驗證 碼 | OTP"])
+
+
+class InternedStagesTest(unittest.TestCase):
+    def test_rule_stage_hints_are_the_stage_constants(self):
+        # stage_scores 的 key（規則的 stage_hint）跟查詢用的 STAGE_* 常數要是同一個物件
+        stages = {id(st) for st in scamshield.STAGE_ORDER}
+        for rules in (DEFAULT_RULES, scamshield.get_rules(force_reload=True)):
+            for rule in rules:
+                with self.subTest(rule=rule.name):
+                    self.assertIn(id(rule.stage_hint), stages)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+webapp 的 ASGI 層（body 上限、API key middleware）：用 TestClient 打整個 app
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SCAMSHIELD_API_KEYS", "sk_test_pro_1234:pro")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import webapp  # noqa: E402
+
+JSON = {"content-type": "application/json"}
+API_KEY = {"X-API-Key": "sk_test_pro_1234"}
+ANALYZE_PATHS = (("/analyze", {}), ("/api/v1/analyze", API_KEY))
+
+
+def _chunks(body, size=4096):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+class BodySizeLimitTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._rate = webapp.RATE_LIMIT_PER_MIN
+        webapp.RATE_LIMIT_PER_MIN = 10**9
+        cls.client = TestClient(webapp.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        webapp.RATE_LIMIT_PER_MIN = cls._rate
+
+    def test_valid_bodies_pass(self):
+        # 都過得了 handler 的 5000 字檢查，不能在 ASGI 層被 413 擋掉
+        bodies = {
+            "emoji": json.dumps({"text": "😀" * 5000}).encode(),  # 一個字跳脫成 12 bytes
+            "padded": json.dumps({"text": " " * 100000 + "匯" * 5000 + "\n" * 100000}).encode(),
+            "context": json.dumps({"text": "匯款", "context": {"k": "x" * 100000}}).encode(),
+        }
+        for path, headers in ANALYZE_PATHS:
+            for name, body in bodies.items():
+                with self.subTest(path=path, body=name):
+                    r = self.client.post(path, content=body, headers={**JSON, **headers})
+                    self.assertEqual(r.status_code, 200, r.text)
+                    r = self.client.post(path, content=_chunks(body), headers={**JSON, **headers})
+                    self.assertEqual(r.status_code, 200, r.text)
+
+    def test_oversized_body_is_413(self):
+        body = json.dumps({"text": "x" * webapp.MAX_ANALYZE_BODY_BYTES}).encode()
+        for path, headers in ANALYZE_PATHS:
+            with self.subTest(path=path):
+                r = self.client.post(path, content=body, headers={**JSON, **headers})
+                self.assertEqual(r.status_code, 413)
+                r = self.client.post(path, content=_chunks(body, 65536), headers={**JSON, **headers})
+                self.assertEqual(r.status_code, 413)
+
+
+class APIKeyMiddlewareTest(unittest.TestCase):
+    def test_openapi_documents_key_headers(self):
+        spec = webapp.app.openapi()
+        for path, method in (("/api/v1/analyze", "post"), ("/api/v1/usage", "get")):
+            with self.subTest(path=path):
+                names = [p["name"] for p in spec["paths"][path][method]["parameters"] if p["in"] == "header"]
+                self.assertEqual(names, ["authorization", "x-api-key"])
+
+    def test_root_path_deployment(self):
+        client = TestClient(webapp.app, root_path="/prefix")
+        r = client.get("/prefix/api/v1/usage", headers=API_KEY)
+        self.assertEqual(r.status_code, 200, r.text)
+        self.assertEqual(r.json()["plan"], "pro")
+        r = client.get("/prefix/api/v1/usage")
+        self.assertEqual((r.status_code, r.json()), (401, {"detail": "Missing API key"}))
+
+    def test_auth_is_checked_before_the_body(self):
+        for body in (b"{not json", b'{"context": {}}'):
+            with self.subTest(body=body):
+                r = TestClient(webapp.app).post("/api/v1/analyze", content=body, headers={**JSON, "X-API-Key": "bad"})
+                self.assertEqual(r.status_code, 401)
+                r = TestClient(webapp.app).post("/api/v1/analyze", content=body, headers={**JSON, **API_KEY})
+                self.assertEqual(r.status_code, 422)
+
+    def test_route_missing_from_middleware_is_401(self):
+        routes = webapp.API_KEY_ROUTES
+        webapp.API_KEY_ROUTES = frozenset()
+        try:
+            r = TestClient(webapp.app).get("/api/v1/usage", headers=API_KEY)
+        finally:
+            webapp.API_KEY_ROUTES = routes
+        self.assertEqual((r.status_code, r.json()), (401, {"detail": "Missing API key"}))
+
+
+class QuotaTest(unittest.TestCase):
+    def setUp(self):
+        self._env = {k: os.environ.get(k) for k in ("SCAMSHIELD_API_KEYS", "PLAN_DAILY_QUOTAS")}
+        os.environ["SCAMSHIELD_API_KEYS"] = "sk_test_free_1234:free,sk_test_gold_1234:gold"
+        os.environ["PLAN_DAILY_QUOTAS"] = '{"free": 2, "pro": 500}'
+        self.client = TestClient(webapp.app)
+
+    def tearDown(self):
+        for k, v in self._env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def test_quota_is_enforced(self):
+        headers = {"X-API-Key": "sk_test_free_1234"}
+        webapp._usage_table().pop("sk_test_free_1234", None)
+        codes = [self.client.post("/api/v1/analyze", json={"text": "匯款"}, headers=headers).status_code for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+
+    def test_unknown_plan_is_warned_once(self):
+        headers = {"X-API-Key": "sk_test_gold_1234"}
+        webapp._warned_plans.discard("gold")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            for _ in range(3):
+                self.client.get("/api/v1/usage", headers=headers)
+        self.assertEqual(out.getvalue().count("'gold' not in PLAN_DAILY_QUOTAS"), 1)
+
+    def test_unknown_plan_is_rejected_at_auth(self):
+        headers = {"X-API-Key": "sk_test_gold_1234"}
+        for r in (
+            self.client.post("/api/v1/analyze", json={"text": "匯款"}, headers=headers),
+            self.client.get("/api/v1/usage", headers=headers),
+        ):
+            self.assertEqual(r.status_code, 403)
+            self.assertIn("gold", r.json()["detail"])
+
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self._rate = webapp.RATE_LIMIT_PER_MIN
+        webapp._rate_ip.clear()
+
+    def tearDown(self):
+        webapp.RATE_LIMIT_PER_MIN = self._rate
+        webapp._rate_ip.clear()
+
+    def test_burst_is_exactly_the_limit(self):
+        # 60 除不盡的上限也要一口氣給滿 N 次、第 N+1 次擋掉；換幾個不同的時鐘起點
+        clock = [0]
+        with mock.patch.object(webapp.time, "monotonic_ns", lambda: clock[0]):
+            for limit in (7, 13, 30, 45, 60, 100):
+                webapp.RATE_LIMIT_PER_MIN = limit
+                for start in (1, 123_456_789_012, 987_654_321_987_654, 2**53 + 12345):
+                    with self.subTest(limit=limit, start=start):
+                        clock[0] = start
+                        ip = f"{limit}-{start}"
+                        burst = [webapp._rate_limit_ok_ip(ip) for _ in range(limit + 1)]
+                        self.assertEqual(burst, [True] * limit + [False])
+                        clock[0] += 60 * 1_000_000_000 // limit
+                        self.assertTrue(webapp._rate_limit_ok_ip(ip))
+                        self.assertFalse(webapp._rate_limit_ok_ip(ip))
+
+
+class LineReplyTest(unittest.TestCase):
+    def test_authorization_follows_the_current_token(self):
+        post = mock.Mock(return_value=mock.Mock(status_code=200))
+        with mock.patch.object(webapp._LINE_SESSION, "post", post):
+            for token in ("token-a", "token-b"):
+                with mock.patch.object(webapp, "LINE_CHANNEL_ACCESS_TOKEN", token):
+                    webapp._line_reply("reply-token", "hi")
+                self.assertEqual(post.call_args.kwargs["headers"], {"Authorization": f"Bearer {token}"})
+            with mock.patch.object(webapp, "LINE_CHANNEL_ACCESS_TOKEN", ""):
+                webapp._line_reply("reply-token", "hi")
+        self.assertEqual(post.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,27 +5,44 @@ import os
 import time
 import secrets
 import hashlib
+import heapq
+import threading
 from pathlib import Path
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
+from functools import lru_cache
+from operator import itemgetter
 from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, Request, Header, HTTPException, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, Header, HTTPException, Depends, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from pydantic import BaseModel, Field
 
 from scamshield import analyze_text
 
+try:
+    import orjson  # 選用：有裝就用它把 analyze 結果直接編成 JSON bytes
+except ImportError:
+    orjson = None
+
 app = FastAPI(title="ScamShield Web", version="1.6.0")
 
 # ======================
 # LINE Bot 設定（全域）
 # ======================
 import requests
+from requests.adapters import HTTPAdapter
 
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET", "")
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
 
+# 共用一個 Session：連到 api.line.me 的連線 keep-alive 重用，不用每次回覆都重新 TCP + TLS 握手
+_LINE_SESSION = requests.Session()
+_LINE_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50))
+_LINE_SESSION.headers["Content-Type"] = "application/json"
+
 def _line_reply(reply_token: str, text: str) -> None:
     """
     用 LINE Messaging API 回覆文字訊息
@@ -35,17 +52,15 @@ def _line_reply(reply_token: str, text: str) -> None:
         return
 
     url = "https://api.line.me/v2/bot/message/reply"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-    }
     payload = {
         "replyToken": reply_token,
         "messages": [{"type": "text", "text": text[:5000]}],
     }
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=10)
+        # token 每次從全域拿：跟上面的檢查用同一個值（測試/重新設定改了全域也跟得上）
+        headers = {"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"}
+        r = _LINE_SESSION.post(url, headers=headers, json=payload, timeout=10)
         if r.status_code >= 400:
             print("LINE reply failed:", r.status_code, r.text)
     except Exception as e:
@@ -120,11 +135,28 @@ def format_line_reply(result: dict) -> str:
 MAX_TEXT_CHARS = 5000
 RATE_LIMIT_PER_MIN = 30
 
+# analyze 的 request body 上限（bytes）：只是擋濫用的寬鬆上限，text 字數的精確檢查還是在 handler（strip 之後）
+# 不能抓太緊：emoji 跳脫成 \ud83d\ude00 一個字就 12 bytes（5000 字約 60KB）、前後空白會被 strip 掉、context 沒有大小限制
+MAX_ANALYZE_BODY_BYTES = 1024 * 1024
+
+# 比這長才把 analyze_text 丟 threadpool：2000 字約 0.5ms，切 thread 一次約 65µs，短文字直接跑比較快
+ANALYZE_THREADPOOL_MIN_CHARS = 2000
+
 # ===== Web IP rate limit（給 /analyze 用）=====
-_rate_ip: Dict[str, list] = {}  # ip -> [window_start, count]
+# GCRA（token bucket 的單一數字版）：每個 ip 只存一個 int「理論上下一次到達時間」(TAT，monotonic 奈秒)
+# - 全用整數算：float 秒數累加會有誤差，有些時間點一口氣只給得到 RATE_LIMIT_PER_MIN - 1 次
+# - 每分鐘 RATE_LIMIT_PER_MIN 次、平均每 60/RATE_LIMIT_PER_MIN 秒補一次，最多一口氣用掉 RATE_LIMIT_PER_MIN 次
+# - 不會像固定 60 秒視窗那樣，在視窗交界前後各打滿一次（短時間內 2 倍）
+# 用 OrderedDict 當 LRU，最多記 RATE_LIMIT_MAX_IPS 個 ip，不會無限長大
+RATE_LIMIT_MAX_IPS = 50_000
+_RATE_WINDOW_NS = 60 * 1_000_000_000
+_rate_ip: "OrderedDict[str, int]" = OrderedDict()  # ip -> TAT（time.monotonic_ns()）
+_rate_ip_lock = threading.Lock()
 
 # ===== API 授權用量（記憶體版：單機準、多 instance 會不準；之後可升級 Redis/DB）=====
-_usage_by_key: Dict[str, Dict[str, int]] = {}  # api_key -> {"YYYY-MM-DD": count}
+# 只會讀到「今天（UTC）」的用量：只留今天一張表，換日時整張換掉（舊的天數也不會一直累積）
+_usage_day_num = -1  # _usage_today 是哪一天（epoch 起算第幾天，UTC）
+_usage_today: Dict[str, int] = {}  # api_key -> 今天用量
 
 POLICY_VERSION = "2026.01"
 MODEL_VERSION = "rules-v1"
@@ -137,40 +169,56 @@ _STATS: Dict[str, Any] = {
     "total": 0,
     "by_level": {"low": 0, "medium": 0, "high": 0, "critical": 0},
     "by_type": {},  # scam_type -> count
-    "last_50": [],  # 最近 50 次（只記匿名摘要）
+    "last_50": deque(maxlen=50),  # 最近 50 次（只記匿名摘要；新的在前，超過 50 筆自動丟最舊的）
 
     # ✅ 趨勢：日/小時聚合（UTC）
     "daily": {},   # day -> {total, score_sum, by_level, by_type}
     "hourly": {},  # hour -> {total, score_sum, by_level}
 }
 
+# 日期/小時字串一天/一小時才會變：記住目前是第幾天/第幾小時（epoch 起算，UTC），變了才重新 strftime
+# 整個 tuple 一次換掉，不用 lock
+_utc_day_cache: Tuple[int, str] = (-1, "")
+_utc_hour_cache: Tuple[int, str] = (-1, "")
+
+
+def _utc_day_num() -> int:
+    return int(time.time()) // 86400
+
+
 def _utc_day() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    global _utc_day_cache
+    d = _utc_day_num()
+    if _utc_day_cache[0] != d:
+        _utc_day_cache = (d, time.strftime("%Y-%m-%d", time.gmtime(d * 86400)))
+    return _utc_day_cache[1]
 
 
 def _utc_hour() -> str:
     # e.g. "2026-01-11 05"
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H")
+    global _utc_hour_cache
+    h = int(time.time()) // 3600
+    if _utc_hour_cache[0] != h:
+        _utc_hour_cache = (h, time.strftime("%Y-%m-%d %H", time.gmtime(h * 3600)))
+    return _utc_hour_cache[1]
 
 
 def _now_iso_utc() -> str:
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
 
+# daily / hourly 只會在 _stats_add 用「現在」的日期/小時 setdefault 新 key：dict 的插入順序就是時間順序
+# 超過上限從最前面（最舊）刪，不用每次 sorted 全部 key
 def _prune_hourly(max_hours: int = 48) -> None:
-    keys = sorted(_STATS["hourly"].keys())
-    if len(keys) <= max_hours:
-        return
-    for k in keys[:-max_hours]:
-        _STATS["hourly"].pop(k, None)
+    hourly = _STATS["hourly"]
+    while len(hourly) > max_hours:
+        del hourly[next(iter(hourly))]
 
 
 def _prune_daily(max_days: int = 90) -> None:
-    keys = sorted(_STATS["daily"].keys())
-    if len(keys) <= max_days:
-        return
-    for k in keys[:-max_days]:
-        _STATS["daily"].pop(k, None)
+    daily = _STATS["daily"]
+    while len(daily) > max_days:
+        del daily[next(iter(daily))]
 
 
 def _client_ip(req: Request) -> str:
@@ -181,26 +229,30 @@ def _client_ip(req: Request) -> str:
 
 
 def _rate_limit_ok_ip(ip: str) -> bool:
-    now = time.time()
-    rec = _rate_ip.get(ip)
-    if rec is None:
-        _rate_ip[ip] = [now, 1]
-        return True
-
-    window_start, count = rec
-    if now - window_start >= 60:
-        _rate_ip[ip] = [now, 1]
+    now = time.monotonic_ns()  # 用 monotonic：校時/NTP 跳時間也不影響
+    interval = _RATE_WINDOW_NS // RATE_LIMIT_PER_MIN  # 無條件捨去：N * interval <= 60 秒，一口氣一定給得到 N 次
+    with _rate_ip_lock:
+        tat = _rate_ip.get(ip, now)
+        new_tat = (tat if tat > now else now) + interval
+        if new_tat - now > _RATE_WINDOW_NS:
+            _rate_ip.move_to_end(ip)
+            return False
+
+        _rate_ip[ip] = new_tat
+        _rate_ip.move_to_end(ip)
+        if len(_rate_ip) > RATE_LIMIT_MAX_IPS:
+            _rate_ip.popitem(last=False)  # 丟掉最久沒出現的 ip
         return True
 
-    if count >= RATE_LIMIT_PER_MIN:
-        return False
 
-    rec[1] = count + 1
-    return True
+# 每個付費 API request 都要查 key / 額度：env 字串沒變就不重新 parse（lru_cache 以原字串當 key）
+# 回傳的 dict 是共用的，呼叫端只能讀不能改
+def _parse_plan_quotas() -> Dict[str, int]:
+    return _plan_quotas_from(os.getenv("PLAN_DAILY_QUOTAS", '{"free":50,"pro":500,"enterprise":999999}'))
 
 
-def _parse_plan_quotas() -> Dict[str, int]:
-    raw = os.getenv("PLAN_DAILY_QUOTAS", '{"free":50,"pro":500,"enterprise":999999}')
+@lru_cache(maxsize=8)
+def _plan_quotas_from(raw: str) -> Dict[str, int]:
     try:
         data = json.loads(raw)
         out: Dict[str, int] = {}
@@ -211,13 +263,33 @@ def _parse_plan_quotas() -> Dict[str, int]:
         return {"free": 50, "pro": 500, "enterprise": 999999}
 
 
-def _parse_api_keys() -> Dict[str, str]:
+# 每個 process 一把隨機 pepper：key 表跟 admin 比對都用 keyed BLAKE2b 摘要
+# - 原始 key 不當 dict key 留在表裡
+# - 比對的兩邊固定 16 bytes（compare_digest 遇到非 ASCII 的 str 會直接丟 TypeError）
+_KEY_PEPPER = secrets.token_bytes(16)
+
+
+def _key_digest(key: str) -> bytes:
+    return hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=16, key=_KEY_PEPPER).digest()
+
+
+@lru_cache(maxsize=8)
+def _admin_digest(admin_key: str) -> bytes:
+    return _key_digest(admin_key)
+
+
+def _parse_api_keys() -> Dict[bytes, str]:
     """
     Render env: SCAMSHIELD_API_KEYS="sk_free_xxx:free,sk_pro_yyy:pro"
-    回傳 dict: api_key -> plan
+    回傳 dict: _key_digest(api_key) -> plan
     """
-    raw = os.getenv("SCAMSHIELD_API_KEYS", "").strip()
-    out: Dict[str, str] = {}
+    return _api_keys_from(os.getenv("SCAMSHIELD_API_KEYS", ""))
+
+
+@lru_cache(maxsize=8)
+def _api_keys_from(raw: str) -> Dict[bytes, str]:
+    raw = raw.strip()
+    out: Dict[bytes, str] = {}
     if not raw:
         return out
 
@@ -229,27 +301,51 @@ def _parse_api_keys() -> Dict[str, str]:
         key = key.strip()
         plan = plan.strip().lower()
         if key:
-            out[key] = plan
+            out[_key_digest(key)] = plan
     return out
 
 
-def _check_and_inc_usage(api_key: str, plan: str, quotas: Dict[str, int]) -> Tuple[int, int, int]:
+def _usage_table() -> Dict[str, int]:
     """
-    回傳 (used_today, remaining_today, quota)
+    今天的用量表；UTC 換日就換一張新的
+    用整數天數比對，不用每次 strftime 出日期字串
     """
-    day = _utc_day()
-    quota = int(quotas.get(plan, 0))
+    global _usage_day_num, _usage_today
+    day_num = _utc_day_num()
+    if day_num != _usage_day_num:
+        _usage_day_num = day_num
+        _usage_today = {}
+    return _usage_today
 
-    per_key = _usage_by_key.setdefault(api_key, {})
-    used = int(per_key.get(day, 0))
+
+def _check_and_inc_usage(api_key: str, quota: int) -> Tuple[bool, int, int]:
+    """
+    回傳 (allowed, used_today, remaining_today)；quota 用驗證時算好的 auth["quota"]
+    - 額度用完：allowed=False，這次不計入用量
+    - 查一次、寫一次；能走到 +1 代表 used < quota，remaining 不會是負的
+    - 額度的「檢查 + 扣」只在這裡做，而且必須保持同步：讀和寫之間不能有 await，
+      不然同一把 key 的並發 request 會一起讀到 quota-1、一起放行（多給額度）
+      要換 Redis 時整段換成一個原子操作（INCR + EXPIRE 的 Lua script），呼叫端不用改
+    """
+    usage = _usage_table()
+    used = usage.get(api_key, 0)
 
     if used >= quota:
-        return used, 0, quota
+        return False, used, 0
 
     used += 1
-    per_key[day] = used
-    remaining = max(quota - used, 0)
-    return used, remaining, quota
+    usage[api_key] = used
+    return True, used, quota - used
+
+
+async def _analyze_async(text: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    handler 都是 async：短文字直接在 event loop 上分析
+    長文字丟 threadpool，掃描期間 event loop 還能接別的 request，不會被一個長訊息卡住
+    """
+    if len(text) < ANALYZE_THREADPOOL_MIN_CHARS:
+        return analyze_text(text, context=context)
+    return await run_in_threadpool(analyze_text, text, context)
 
 
 def _mask_key(k: str) -> str:
@@ -258,14 +354,22 @@ def _mask_key(k: str) -> str:
     return k[:4] + "..." + k[-4:]
 
 
+@lru_cache(maxsize=8)
+def _salted_sha256(salt: str):
+    # SALT 那段每次都一樣：先算好狀態，之後 copy() 接著餵原文就好
+    return hashlib.sha256((salt + "\n").encode("utf-8"))
+
+
 def _stable_anon_id(text: str) -> str:
     """
     不可逆的摘要 id（只用於辨識重複事件，不可回推出原文）
     - 加 SALT：避免有人拿字典撞 hash
+    - 結果跟 sha256(salt + "\n" + text)[:12] 一樣，已存的 id 不會變
     """
     salt = os.getenv("STATS_SALT", "scamshield-default-salt")
-    h = hashlib.sha256((salt + "\n" + text).encode("utf-8")).hexdigest()
-    return h[:12]
+    h = _salted_sha256(salt).copy()
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()[:12]
 
 
 def _stats_add(summary: Dict[str, Any]) -> None:
@@ -285,8 +389,7 @@ def _stats_add(summary: Dict[str, Any]) -> None:
         _STATS["by_type"][t] = int(_STATS["by_type"].get(t, 0)) + 1
 
     # last_50
-    _STATS["last_50"].insert(0, summary)
-    _STATS["last_50"] = _STATS["last_50"][:50]
+    _STATS["last_50"].appendleft(summary)
 
     # daily
     day = _utc_day()
@@ -320,6 +423,15 @@ def _stats_add(summary: Dict[str, Any]) -> None:
     _prune_daily(90)
 
 
+async def _record_stats(text: str, summary: Dict[str, Any]) -> None:
+    """
+    response 送出後才記統計（BackgroundTasks），算指紋 + 聚合不佔 /analyze 的回應時間
+    - 宣告成 async：在 event loop 上跑，不會丟進 threadpool 跟別的 request 同時改 _STATS
+    """
+    summary["anon_id"] = _stable_anon_id(text)
+    _stats_add(summary)
+
+
 def _extract_suspicious_urls_from_result(result: Dict[str, Any]) -> List[str]:
     """
     盡量從 analyze_text 的輸出裡找出可疑網址（你不一定有這個欄位，所以做保底）
@@ -341,14 +453,24 @@ def _extract_suspicious_urls_from_result(result: Dict[str, Any]) -> List[str]:
     return out
 
 
+@lru_cache(maxsize=64)
+def _error_body(detail: str) -> bytes:
+    """
+    {"detail": ...} 的 JSON bytes（跟 JSONResponse 編出來的一樣）
+    錯誤訊息就那幾種：編一次留著，被狂打 400/401/429 時不用每次 json.dumps
+    """
+    return JSONResponse(content={"detail": detail}).body
+
+
+def _error_response(status_code: int, detail: str) -> Response:
+    return Response(content=_error_body(detail), status_code=status_code, media_type="application/json")
+
+
 # =========================
-# Auth dependencies
+# Auth（API key middleware + admin dependency）
 # =========================
 
-async def require_api_key(
-    authorization: Optional[str] = Header(default=None),
-    x_api_key: Optional[str] = Header(default=None),
-) -> Dict[str, Any]:
+def _authenticate_api_key(authorization: Optional[str], x_api_key: Optional[str]) -> Dict[str, Any]:
     """
     支援：
     - Authorization: Bearer <key>
@@ -367,14 +489,156 @@ async def require_api_key(
     if not key:
         raise HTTPException(status_code=401, detail="Missing API key")
 
-    if admin_key and secrets.compare_digest(key, admin_key):
+    digest = _key_digest(key)
+    if admin_key and secrets.compare_digest(digest, _admin_digest(admin_key)):
         return {"api_key": key, "plan": "enterprise", "is_admin": True, "quota": quotas.get("enterprise", 999999)}
 
-    plan = keys.get(key)
+    plan = keys.get(digest)
     if not plan:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
-    return {"api_key": key, "plan": plan, "is_admin": False, "quota": quotas.get(plan, 0)}
+    # plan 沒在 PLAN_DAILY_QUOTAS 裡 = 設定漏了：明確拒絕 + 記 log，不要默默當成額度 0（每次都 429，看起來像額度用完）
+    quota = quotas.get(plan)
+    if quota is None:
+        _warn_unknown_plan(plan)
+        raise HTTPException(status_code=403, detail=f"API key 的方案（{plan}）沒有設定額度")
+
+    return {"api_key": key, "plan": plan, "is_admin": False, "quota": quota}
+
+
+_warned_plans: set = set()  # 已經印過警告的 plan：每個只印一次，不要每個 request 都洗 log
+
+
+def _warn_unknown_plan(plan: str) -> None:
+    if plan in _warned_plans:
+        return
+    _warned_plans.add(plan)
+    print(f"[WARN] API key plan {plan!r} not in PLAN_DAILY_QUOTAS; rejecting its keys with 403")
+
+
+# 要帶 API key 的 (method, path)（付費 API）；method 不對的照舊交給路由回 405
+API_KEY_ROUTES = frozenset((("POST", "/api/v1/analyze"), ("GET", "/api/v1/usage")))
+
+# 驗證在 middleware 做，FastAPI 看不到這兩個 header：只為了 /docs（Swagger 的 Try it out 才帶得了 key）補回去
+# 內容跟以前 Header() 參數產生的一樣
+API_KEY_OPENAPI: Dict[str, Any] = {
+    "parameters": [
+        {
+            "name": name,
+            "in": "header",
+            "required": False,
+            "schema": {"anyOf": [{"type": "string"}, {"type": "null"}], "title": title},
+        }
+        for name, title in (("authorization", "Authorization"), ("x-api-key", "X-Api-Key"))
+    ]
+}
+
+
+def _scope_route(scope: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    (method, path)，拿來對 API_KEY_ROUTES / ANALYZE_ROUTES
+    用 --root-path 部署時 scope["path"] 會帶著前綴，先扣掉（跟路由比對時一樣）
+    """
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    return scope["method"], path
+
+
+class APIKeyMiddleware:
+    """
+    付費 API 的 API key 驗證，做成純 ASGI middleware：
+    - 直接掃 scope["headers"] 拿 Authorization / X-API-Key，不走 Depends（FastAPI 解析依賴每次要多花約 60µs）
+    - 驗證過的結果放在 request.state.auth；失敗直接回 401，跟原本 HTTPException 的回應一樣
+    - endpoint 讀 auth 一律用 _request_auth()：middleware 沒套到（路由沒加進 API_KEY_ROUTES）也是回 401，不會 500
+    - 順序：先驗 key 才讀 body。key 沒帶/不對一律 401，body 爛掉（JSON 解不開）也一樣；
+      以前走 Depends 時，JSON 解不開會先回 422（欄位不對才是 401），現在統一先 401、key 對了才看 body 回 422
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or _scope_route(scope) not in API_KEY_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        # 同名 header 出現多次時取第一個（跟 Header() 一樣）
+        authorization: Optional[str] = None
+        x_api_key: Optional[str] = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if authorization is None:
+                    authorization = value.decode("latin-1")
+            elif name == b"x-api-key":
+                if x_api_key is None:
+                    x_api_key = value.decode("latin-1")
+
+        try:
+            auth = _authenticate_api_key(authorization, x_api_key)
+        except HTTPException as e:
+            await _error_response(e.status_code, e.detail)(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["auth"] = auth
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(APIKeyMiddleware)
+
+
+def _request_auth(req: Request) -> Optional[Dict[str, Any]]:
+    """APIKeyMiddleware 驗證過的結果；沒經過 middleware 就是 None（呼叫端回 401）"""
+    return getattr(req.state, "auth", None)
+
+
+# =========================
+# Request body size limit（analyze 用）
+# =========================
+
+ANALYZE_ROUTES = frozenset((("POST", "/analyze"), ("POST", "/api/v1/analyze")))
+
+
+class BodySizeLimitMiddleware:
+    """
+    analyze 的 body 太大就在 ASGI 這層直接回 413，不用讀完整包再丟給 pydantic 解 JSON：
+    - 有 Content-Length：看 header 就擋
+    - 沒有（chunked）：邊收邊算，超過就丟 HTTPException(413)（FastAPI 讀 body 時會原樣往外拋）
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or _scope_route(scope) not in ANALYZE_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                # 長度跟 Content-Length 對不上的 body，server（uvicorn）那層就會擋掉
+                if value.isdigit() and int(value) > MAX_ANALYZE_BODY_BYTES:
+                    await _error_response(413, "request body 太大（上限 1MB）")(scope, receive, send)
+                    return
+                await self.app(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Dict[str, Any]:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_ANALYZE_BODY_BYTES:
+                    raise HTTPException(status_code=413, detail="request body 太大（上限 1MB）")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(BodySizeLimitMiddleware)
 
 
 async def require_admin(
@@ -386,6 +650,7 @@ async def require_admin(
     支援：
     - Authorization: Bearer <ADMIN_KEY>
     - X-Admin-Key: <ADMIN_KEY>
+    刻意寫成 async def：裡面沒有 I/O，sync def 的依賴 FastAPI 會丟去 threadpool 跑，反而多一次切換
     """
     admin_key = os.getenv("ADMIN_KEY", "").strip()
 
@@ -398,7 +663,7 @@ async def require_admin(
     if not admin_key:
         raise HTTPException(status_code=500, detail="ADMIN_KEY not configured")
 
-    if not key or not secrets.compare_digest(key, admin_key):
+    if not key or not secrets.compare_digest(_key_digest(key), _admin_digest(admin_key)):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     return {"is_admin": True}
@@ -441,6 +706,48 @@ class AnalyzeResponse(BaseModel):
     entities: Optional[Dict[str, Any]] = None
 
 
+# 回應照 AnalyzeResponse 的欄位順序輸出、丟掉其他欄位（例如 stage）：直接編 JSON 時照這張表挑
+_ANALYZE_RESPONSE_FIELDS = tuple(
+    (name, f.is_required(), f.default) for name, f in AnalyzeResponse.model_fields.items()
+)
+
+# 兩個 analyze endpoint 不掛 response_model（省掉每次 pydantic 驗證 + 序列化），schema 只留給 OpenAPI 文件
+ANALYZE_RESPONSES: Dict[Any, Dict[str, Any]] = {200: {"model": AnalyzeResponse}}
+
+
+def _analyze_response(response: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    照 AnalyzeResponse 的欄位挑出來直接編成 JSON 回傳（輸出跟以前走 response_model 一樣）
+    有 orjson 用 orjson，沒裝就用 JSONResponse（標準 json）；headers 建 Response 時一起帶進去
+    """
+    body = {
+        name: response[name] if required else response.get(name, default)
+        for name, required, default in _ANALYZE_RESPONSE_FIELDS
+    }
+    if orjson is None:
+        return JSONResponse(content=body, headers=headers)
+    return Response(content=orjson.dumps(body), media_type="application/json", headers=headers)
+
+
+# request_id 不拿來做授權，64 bits 亂數就夠：一次跟 OS 拿 16KB、從尾巴往前切 8 bytes，省掉每個 request 一次 syscall
+_REQUEST_ID_BUF_SIZE = 16 * 1024
+_request_id_buf = b""
+_request_id_off = 0
+_request_id_lock = threading.Lock()
+
+
+def _new_request_id() -> str:
+    """16 個 hex 字元的 request_id（跟 secrets.token_hex(8) 同格式）"""
+    global _request_id_buf, _request_id_off
+    with _request_id_lock:
+        if _request_id_off < 8:
+            _request_id_buf = os.urandom(_REQUEST_ID_BUF_SIZE)
+            _request_id_off = _REQUEST_ID_BUF_SIZE
+        end = _request_id_off
+        _request_id_off = end - 8
+        return _request_id_buf[end - 8:end].hex()
+
+
 
 # =========================
 # Basic routes
@@ -469,7 +776,7 @@ async def line_webhook(req: Request, x_line_signature: str = Header(None)):
             continue
 
         try:
-            result = analyze_text(user_text, context=None)
+            result = await _analyze_async(user_text)
             reply = format_line_reply(result)  # ✅ Whoscall 版回覆
         except Exception as e:
             reply = f"靠杯我剛剛分析爆掉了：{e}"
@@ -482,9 +789,26 @@ async def line_webhook(req: Request, x_line_signature: str = Header(None)):
 
 
 
-@app.get("/", response_class=HTMLResponse)
-def home():
-    return """
+# 首頁 / API 文件是固定內容：啟動時先編碼成 bytes，每次 GET 直接送，不用再 encode
+# 另外帶 ETag：瀏覽器/CDN 重新驗證時內容沒變就回 304，不用再傳一次整頁
+
+def _static_page_headers(body: bytes) -> Dict[str, str]:
+    return {
+        "Cache-Control": "public, max-age=300",
+        "ETag": '"' + hashlib.sha1(body).hexdigest()[:16] + '"',
+    }
+
+
+def _static_page(req: Request, body: bytes, headers: Dict[str, str]) -> Response:
+    inm = req.headers.get("if-none-match")
+    if inm:
+        tags = [t.strip() for t in inm.split(",")]
+        if "*" in tags or headers["ETag"] in (t[2:] if t.startswith("W/") else t for t in tags):
+            return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
+
+
+HOME_HTML = """
 <!doctype html>
 <html lang="zh-Hant">
 <head>
@@ -821,67 +1145,74 @@ async function copyTemplates(){
 </body>
 </html>
 """
+_HOME_HTML_BYTES = HOME_HTML.encode("utf-8")
+_HOME_HEADERS = _static_page_headers(_HOME_HTML_BYTES)
+
+
+@app.get("/", response_class=HTMLResponse)
+def home(req: Request):
+    return _static_page(req, _HOME_HTML_BYTES, _HOME_HEADERS)
 
 
 # =========================
 # Web analyze (IP rate limit + optional anon stats)
 # =========================
 
-@app.post("/analyze", response_model=AnalyzeResponse)
-async def analyze_web(body: AnalyzeRequest, req: Request):
+@app.post("/analyze", responses=ANALYZE_RESPONSES)
+async def analyze_web(body: AnalyzeRequest, req: Request, background_tasks: BackgroundTasks):
     ip = _client_ip(req)
     if not _rate_limit_ok_ip(ip):
-        return JSONResponse(status_code=429, content={"detail": "太多次啦靠杯（rate limit）— 請稍後再試"})
+        return _error_response(429, "太多次啦靠杯（rate limit）— 請稍後再試")
 
     text = (body.text or "").strip()
     if not text:
-        return JSONResponse(status_code=400, content={"detail": "text 不能是空的"})
+        return _error_response(400, "text 不能是空的")
     if len(text) > MAX_TEXT_CHARS:
-        return JSONResponse(status_code=400, content={"detail": f"text 太長（最多 {MAX_TEXT_CHARS} 字）"})
+        return _error_response(400, f"text 太長（最多 {MAX_TEXT_CHARS} 字）")
 
     try:
-        result = analyze_text(text, context=body.context)
+        result = await _analyze_async(text, body.context)
 
         suspicious_urls = _extract_suspicious_urls_from_result(result)
         if suspicious_urls:
             result["suspicious_urls"] = suspicious_urls
 
         response = {
-            "request_id": secrets.token_hex(8),
+            "request_id": _new_request_id(),
             **result,
             "policy_version": POLICY_VERSION,
             "model_version": MODEL_VERSION,
         }
 
         if bool(body.allow_anon_stats):
-            anon_id = _stable_anon_id(text)
             summary = {
                 "ts_utc": _now_iso_utc(),
                 "risk_level": str(response.get("risk_level", "")).lower(),
                 "risk_score": int(response.get("risk_score", 0) or 0),
                 "scam_types": response.get("scam_types", []) or [],
-                "anon_id": anon_id,
             }
-            _stats_add(summary)
+            background_tasks.add_task(_record_stats, text, summary)
 
-        return response
+        return _analyze_response(response)
 
     except Exception:
-        return JSONResponse(status_code=500, content={"detail": "Internal error"})
+        return _error_response(500, "Internal error")
 
 
 # =========================
 # Paid API (API key + daily quota)
 # =========================
 
-@app.get("/api/v1/usage")
-async def api_usage(auth=Depends(require_api_key)):
+@app.get("/api/v1/usage", openapi_extra=API_KEY_OPENAPI)
+async def api_usage(req: Request):
+    auth = _request_auth(req)
+    if auth is None:
+        return _error_response(401, "Missing API key")
     day = _utc_day()
     api_key = auth["api_key"]
     plan = auth["plan"]
-    quotas = _parse_plan_quotas()
-    quota = int(quotas.get(plan, 0))
-    used = int(_usage_by_key.get(api_key, {}).get(day, 0))
+    quota = auth["quota"]
+    used = _usage_table().get(api_key, 0)
     remaining = max(quota - used, 0)
 
     return {
@@ -896,33 +1227,51 @@ async def api_usage(auth=Depends(require_api_key)):
     }
 
 
-@app.post("/api/v1/analyze", response_model=AnalyzeResponse)
-async def api_analyze(body: AnalyzeRequest, auth=Depends(require_api_key)):
+def _rate_limit_headers(plan: str, quota: int, remaining: int) -> Dict[str, str]:
+    """付費 API 的用量 header；Reset = 下一個 UTC 0 點（epoch 秒），跟每日額度的換日一致"""
+    return {
+        "X-RateLimit-Plan": plan,
+        "X-RateLimit-Limit": str(quota),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str((_utc_day_num() + 1) * 86400),
+    }
+
+
+@app.post("/api/v1/analyze", responses=ANALYZE_RESPONSES, openapi_extra=API_KEY_OPENAPI)
+async def api_analyze(body: AnalyzeRequest, req: Request):
+    auth = _request_auth(req)
+    if auth is None:
+        return _error_response(401, "Missing API key")
     text = (body.text or "").strip()
     if not text:
-        return JSONResponse(status_code=400, content={"detail": "text 不能是空的"})
+        return _error_response(400, "text 不能是空的")
     if len(text) > MAX_TEXT_CHARS:
-        return JSONResponse(status_code=400, content={"detail": f"text 太長（最多 {MAX_TEXT_CHARS} 字）"})
-
-    quotas = _parse_plan_quotas()
-    used, remaining, quota = _check_and_inc_usage(auth["api_key"], auth["plan"], quotas)
-    if used > quota:
-        return JSONResponse(status_code=429, content={"detail": "API quota exceeded", "plan": auth["plan"], "day_utc": _utc_day()})
+        return _error_response(400, f"text 太長（最多 {MAX_TEXT_CHARS} 字）")
+
+    quota = auth["quota"]
+    allowed, used, remaining = _check_and_inc_usage(auth["api_key"], quota)
+    rate_headers = _rate_limit_headers(auth["plan"], quota, remaining)
+    if not allowed:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "API quota exceeded", "plan": auth["plan"], "day_utc": _utc_day()},
+            headers=rate_headers,
+        )
 
     try:
-        result = analyze_text(text, context=body.context)
+        result = await _analyze_async(text, body.context)
         suspicious_urls = _extract_suspicious_urls_from_result(result)
         if suspicious_urls:
             result["suspicious_urls"] = suspicious_urls
 
-        return {
-            "request_id": secrets.token_hex(8),
+        return _analyze_response({
+            "request_id": _new_request_id(),
             **result,
             "policy_version": POLICY_VERSION,
             "model_version": MODEL_VERSION,
-        }
+        }, rate_headers)
     except Exception:
-        return JSONResponse(status_code=500, content={"detail": "Internal error"})
+        return _error_response(500, "Internal error")
 
 
 # =========================
@@ -939,7 +1288,7 @@ async def stats_json(_=Depends(require_admin)):
     avg_score = (score_sum_all / total) if total > 0 else 0.0
 
     bt = _STATS.get("by_type") or {}
-    top_types = sorted(bt.items(), key=lambda x: x[1], reverse=True)[:10]
+    top_types = heapq.nlargest(10, bt.items(), key=itemgetter(1))  # 等同 sorted(..., reverse=True)[:10]
 
     hourly_keys = sorted((_STATS.get("hourly") or {}).keys())[-24:]
     hourly_24h = [{"hour": k, **_STATS["hourly"][k]} for k in hourly_keys]
@@ -954,7 +1303,7 @@ async def stats_json(_=Depends(require_admin)):
         "by_level": _STATS["by_level"],
         "by_type": _STATS["by_type"],
         "top_types": top_types,
-        "last_50": _STATS["last_50"],
+        "last_50": list(_STATS["last_50"]),
         "hourly_24h": hourly_24h,
         "daily_7d": daily_7d,
     }
@@ -966,7 +1315,7 @@ async def reset_stats(_=Depends(require_admin)):
     _STATS["total"] = 0
     _STATS["by_level"] = {"low": 0, "medium": 0, "high": 0, "critical": 0}
     _STATS["by_type"] = {}
-    _STATS["last_50"] = []
+    _STATS["last_50"] = deque(maxlen=50)
     _STATS["daily"] = {}
     _STATS["hourly"] = {}
     return {"ok": True}
@@ -976,7 +1325,7 @@ async def reset_stats(_=Depends(require_admin)):
 async def stats_ui(req: Request):
     admin_key = os.getenv("ADMIN_KEY", "").strip()
     k = (req.query_params.get("k") or "").strip()
-    if not admin_key or not k or not secrets.compare_digest(k, admin_key):
+    if not admin_key or not k or not secrets.compare_digest(_key_digest(k), _admin_digest(admin_key)):
         return HTMLResponse(status_code=401, content="<pre>Unauthorized. 你沒帶 ADMIN_KEY </pre>")
 
 
@@ -1227,9 +1576,7 @@ reload();
 </html>
 """
 
-@app.get("/api-docs", response_class=HTMLResponse)
-async def api_docs():
-    return """
+API_DOCS_HTML = """
 <!doctype html>
 <html lang="zh-Hant">
 <head>
@@ -1348,12 +1695,14 @@ async def api_docs():
       </thead>
       <tbody>
         <tr><td>400</td><td>text 空或超長</td><td>檢查輸入文字</td></tr>
-        <tr><td>401</td><td>Missing/Invalid API key</td><td>確認 header 帶對</td></tr>
+        <tr><td>401</td><td>Missing/Invalid API key（先驗 key 再看 body：key 不對時 body 格式錯也是回 401）</td><td>確認 header 帶對</td></tr>
+        <tr><td>403</td><td>API key 的方案沒有設定額度</td><td>聯絡我們開通方案</td></tr>
+        <tr><td>413</td><td>request body 超過 1MB</td><td>縮短 text / context</td></tr>
         <tr><td>429</td><td>Quota exceeded / rate limit</td><td>等待或升級配額</td></tr>
         <tr><td>500</td><td>Internal error</td><td>稍後重試；必要時回報</td></tr>
       </tbody>
     </table>
-    <p class="muted">備註：你也可以導到 <code>/api/v1/usage</code> 讓客戶自己看剩多少。</p>
+    <p class="muted">備註：你也可以導到 <code>/api/v1/usage</code> 讓客戶自己看剩多少。<code>/api/v1/analyze</code> 的回應也會帶 <code>X-RateLimit-Limit</code> / <code>X-RateLimit-Remaining</code> / <code>X-RateLimit-Reset</code>（下一個 UTC 0 點，epoch 秒）。</p>
   </div>
 
   <div class="card">
@@ -1375,4 +1724,11 @@ document.body.innerHTML = document.body.innerHTML.replaceAll("{BASE}", base);
 </script>
 </body>
 </html>
-"""
\ No newline at end of file
+"""
+_API_DOCS_HTML_BYTES = API_DOCS_HTML.encode("utf-8")
+_API_DOCS_HEADERS = _static_page_headers(_API_DOCS_HTML_BYTES)
+
+
+@app.get("/api-docs", response_class=HTMLResponse)
+async def api_docs(req: Request):
+    return _static_page(req, _API_DOCS_HTML_BYTES, _API_DOCS_HEADERS)
\ No newline at end of file